@@ -1,1105 +1,885 @@
-from flask import Flask, render_template, request, jsonify, send_from_directory
+from quart import Quart, Response, request, jsonify, send_from_directory, url_for
+from quart.json.provider import DefaultJSONProvider
 from werkzeug.utils import secure_filename
 from ultralytics import YOLO
+import torch
+import torch.nn.functional as F
+from torchvision.io import decode_jpeg, ImageReadMode
+from torchvision.ops import batched_nms, box_convert
+import asyncio
 import cv2
 import os
+import stat
 import numpy as np
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+import time
+import gzip
+import hashlib
 import base64
+try:
+    import pybase64 as base64 # SIMD-accelerated drop-in replacement for the stdlib module
+except ImportError:
+    pass
+try:
+    import brotli # Optional: better compression for the index page when installed
+except ImportError:
+    brotli = None
+try:
+    import orjson # Optional: native JSON encoder, used for API responses when installed
+except ImportError:
+    orjson = None
 import secrets # For generating a secure secret key
 import json # For formatting JSON output
 
-app = Flask(__name__)
+app = Quart(__name__)
+
+class OrjsonProvider(DefaultJSONProvider):
+    """
+    JSON provider that serializes with orjson. Responses are built straight from the bytes
+    orjson produces; values it doesn't know fall back to the default provider's conversions.
+    """
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=self.default, option=orjson.OPT_SERIALIZE_NUMPY).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
 
-# Generate a strong, random secret key for session management and security
-# IMPORTANT: For production, consider loading this from an environment variable
-app.secret_key = secrets.token_hex(32) 
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        body = orjson.dumps(obj, default=self.default, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_APPEND_NEWLINE)
+        return self._app.response_class(body, mimetype=self.mimetype)
+
+if orjson is not None:
+    app.json = OrjsonProvider(app)
+basedir = os.path.abspath(os.path.dirname(__file__))
+
+def load_secret_key():
+    """
+    Returns a secret key that stays the same across workers and restarts: APP_SECRET_KEY
+    from the environment, else a key persisted in .secret_key, generated on first run.
+    """
+    key = os.environ.get('APP_SECRET_KEY')
+    if key:
+        return key
+    key_path = os.path.join(basedir, '.secret_key')
+    key = read_secret_key(key_path)
+    if key:
+        return key
+    # Generate a strong, random secret key and persist it readable by the owner only
+    key = secrets.token_hex(32)
+    try:
+        # O_EXCL: when several processes start together exactly one creates the file, the rest use its key
+        fd = os.open(key_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:
+        for _ in range(20): # Give the creating process a moment to write its key
+            existing = read_secret_key(key_path)
+            if existing:
+                return existing
+            time.sleep(0.05)
+        print(f"⚠️ {key_path} is empty or unreadable; using a temporary secret key for this process")
+        return key
+    except OSError as e:
+        print(f"⚠️ Could not create {key_path} ({e}); using a temporary secret key for this process")
+        return key
+    with open(fd, 'w') as f:
+        f.write(key)
+    return key
+
+def read_secret_key(key_path):
+    """Returns the key stored in key_path, or None if it is missing or unreadable."""
+    try:
+        with open(key_path) as f:
+            return f.read().strip() or None
+    except OSError:
+        return None
+
+# Secret key for session management and security
+app.secret_key = load_secret_key()
 
 # Configuration for file uploads and results
-UPLOAD_FOLDER = 'uploads'
-RESULTS_FOLDER = 'results'
+# Quart rejects request bodies over 16 MB by default, too small for full SAR scenes
+MAX_UPLOAD_MB = int(os.environ.get('MAX_UPLOAD_MB', 256))
+app.config['MAX_CONTENT_LENGTH'] = MAX_UPLOAD_MB * 1024 * 1024
+# Uploads and results default to tmpfs (/dev/shm) where available, so writing and serving them stays in RAM
+# The tmpfs directories carry the uid so instances run by different users never share or guess each other's files
+TMPFS_DIR = '/dev/shm' if os.path.isdir('/dev/shm') else None
+UPLOAD_FOLDER = os.environ.get('UPLOAD_DIR', f'{TMPFS_DIR}/sar_uploads-{os.getuid()}' if TMPFS_DIR else 'uploads')
+UPLOAD_MAX_AGE = int(os.environ.get('UPLOAD_MAX_AGE_MINUTES', 60)) * 60 # Older uploads are deleted to bound RAM use
+# Only the tmpfs default is swept automatically; uploads kept on disk are left alone unless UPLOAD_MAX_AGE_MINUTES is set
+SWEEP_UPLOADS = ('UPLOAD_DIR' not in os.environ and TMPFS_DIR is not None) or 'UPLOAD_MAX_AGE_MINUTES' in os.environ
+UPLOAD_CLEANUP_INTERVAL = 300 # Seconds between sweeps of the uploads folder
+RESULTS_FOLDER = os.environ.get('RESULTS_DIR', f'{TMPFS_DIR}/sar_results-{os.getuid()}' if TMPFS_DIR else 'results')
+MAX_RESULTS = int(os.environ.get('MAX_RESULTS', 200)) # Older result images are deleted beyond this count
+# Result image format: BMP skips compression entirely, which is cheaper than encoding small SAR tiles;
+# set RESULT_FORMAT=jpg where the size of the images sent to browsers matters more
+RESULT_FORMAT = os.environ.get('RESULT_FORMAT', 'bmp')
+RESULT_CACHE_SIZE = int(os.environ.get('RESULT_CACHE_SIZE', 512)) # Responses remembered for re-uploads of identical images
 # Allowed image extensions for SAR images
-ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'bmp', 'tiff', 'tif'}
+ALLOWED_EXTENSIONS = frozenset({'png', 'jpg', 'jpeg', 'bmp', 'tiff', 'tif'})
+# Dotted suffixes precomputed once so allowed_file is a single str.endswith call
+_ALLOWED_SUFFIXES = tuple('.' + ext for ext in ALLOWED_EXTENSIONS)
+# Leading bytes of the allowed formats: PNG, JPEG, BMP and little/big-endian TIFF
+IMAGE_SIGNATURES = (b'\x89PNG\r\n\x1a\n', b'\xff\xd8\xff', b'BM', b'II*\x00', b'MM\x00*')
+
+# Micro-batching: concurrent uploads are grouped into a single model call so the
+# per-call launch and Python overhead is paid once per batch instead of once per image
+MAX_BATCH = int(os.environ.get('MAX_BATCH', 8)) # Maximum number of images per forward pass
+BATCH_WINDOW = float(os.environ.get('BATCH_WINDOW_MS', 8)) / 1000 # Seconds to wait for more images before running a partial batch
+THREADS = int(os.environ.get('THREADS', 8)) # Threads for blocking decode/preprocess/encode work
+INPUT_SIZE = 640 # Square network input resolution
+CONF_THRESHOLD = 0.25 # Minimum confidence for a detection to be kept
+IOU_THRESHOLD = 0.7 # Intersection Over Union above which NMS suppresses the weaker of two boxes
+MAX_DETECTIONS = 300 # Upper bound on detections returned per image
+# Large SAR scenes are cut into full-resolution INPUT_SIZE tiles instead of being downscaled to one input,
+# which would shrink small aircraft to a few pixels
+TILE_THRESHOLD = 1280 # Images longer than this on either side are tiled
+TILE_OVERLAP = 64 # Minimum pixels shared by neighbouring tiles: aircraft up to this size lie whole in at least one
+TILE_EDGE_MARGIN = 2 # Boxes within this many pixels of a tile edge inside the scene are treated as cut by it
+TILE_MERGE_IOS = 0.5 # Intersection over the smaller box above which a cut fragment is merged into another box (aircraft don't overlap)
+DEVICE = 'cuda' if torch.cuda.is_available() else 'cpu'
+HALF = DEVICE == 'cuda' # FP16 inference on GPU halves activation bandwidth
+# torch.compile fuses kernels in the PyTorch backend at the cost of a slower startup; set TORCH_COMPILE=0 to disable
+TORCH_COMPILE = os.environ.get('TORCH_COMPILE', '1') != '0'
+
+def make_private_dir(path):
+    """
+    Creates a directory only the current user can access. In a shared, world-writable location such
+    as /dev/shm another local user could create it first, so an existing one must be ours and not a symlink.
+    """
+    try:
+        os.mkdir(path, 0o700)
+    except FileExistsError:
+        pass
+    info = os.lstat(path)
+    if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid():
+        raise RuntimeError(f"{path} exists but is not a directory owned by this user; remove it or choose another folder")
+    if info.st_mode & 0o077:
+        os.chmod(path, 0o700)
 
 # Create necessary directories if they don't exist
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-os.makedirs(RESULTS_FOLDER, exist_ok=True)
-os.makedirs('static', exist_ok=True) # For static assets like CSS/JS if needed later
-os.makedirs('templates', exist_ok=True) # Ensure templates directory exists for index.html
+# A bare mkdir is one syscall when the directory already exists, unlike makedirs(exist_ok=True)
+for folder in (UPLOAD_FOLDER, RESULTS_FOLDER, 'static'): # static: for CSS/JS assets if needed later
+    if TMPFS_DIR and os.path.dirname(os.path.abspath(folder)) == TMPFS_DIR:
+        make_private_dir(folder)
+    elif folder in ('uploads', 'results', 'static'):
+        # The default relative folders sit directly in the working directory, so a single mkdir suffices
+        try:
+            os.mkdir(folder)
+        except FileExistsError:
+            pass
+    else:
+        # UPLOAD_DIR/RESULTS_DIR may point anywhere, including below parents that don't exist yet
+        os.makedirs(folder, exist_ok=True)
 
 # Define the path to the YOLO model
 # It's crucial that 'runs/detect/sar_aircraft_detector/weights/best.pt'
 # exists relative to where app.py is executed, or provide an absolute path.
-basedir = os.path.abspath(os.path.dirname(__file__))
 MODEL_PATH = os.path.join(basedir, 'runs', 'detect', 'sar_aircraft_detector', 'weights', 'best.pt')
+# Ahead-of-time compiled exports produced by build_engine.py are used instead of best.pt when present
+ENGINE_PATH = os.path.splitext(MODEL_PATH)[0] + '.engine' # TensorRT, NVIDIA GPUs only
+ONNX_PATH = os.path.splitext(MODEL_PATH)[0] + '.onnx' # ONNX Runtime
+
+def resolve_model_path():
+    """
+    Returns the fastest available model file: the TensorRT engine on a GPU, the ONNX export on
+    the CPU, falling back to the PyTorch weights. Exports older than best.pt are stale and skipped.
+    """
+    def is_current(path):
+        if not os.path.exists(path):
+            return False
+        return not os.path.exists(MODEL_PATH) or os.path.getmtime(path) >= os.path.getmtime(MODEL_PATH)
+
+    if torch.cuda.is_available():
+        # On a GPU the compiled PyTorch model beats ONNX Runtime, so only the engine is preferred over it
+        return ENGINE_PATH if is_current(ENGINE_PATH) else MODEL_PATH
+    return ONNX_PATH if is_current(ONNX_PATH) else MODEL_PATH
+
+# All model calls run on one dedicated thread: the GPU executes one batch at a time anyway, batches don't
+# queue behind CPU work in the shared pool, and compiled CUDA graphs (recorded per thread) are reused
+GPU_POOL = ThreadPoolExecutor(max_workers=1, thread_name_prefix='sar-gpu')
+
+def postprocess(preds):
+    """
+    Filters raw (B, 4 + classes, anchors) predictions by confidence and runs per-class NMS on the
+    device, returning one (N, 6) [x1, y1, x2, y2, conf, cls] CPU tensor of detections per image.
+    """
+    detections = []
+    for pred in preds.transpose(1, 2): # (anchors, 4 + classes) for each image
+        scores, classes = pred[:, 4:].max(1)
+        keep = scores > CONF_THRESHOLD
+        # Only the anchors above the threshold are converted to float32 and go through NMS
+        boxes = box_convert(pred[keep, :4].float(), 'cxcywh', 'xyxy')
+        scores, classes = scores[keep].float(), classes[keep]
+        kept = batched_nms(boxes, scores, classes, IOU_THRESHOLD)[:MAX_DETECTIONS]
+        detections.append(torch.cat([boxes[kept], scores[kept, None], classes[kept, None].float()], 1))
+    # Only the surviving boxes cross to the host, in a single copy for the whole batch
+    return torch.cat(detections).cpu().split([len(d) for d in detections])
+
+@torch.inference_mode()
+def predict_batch(tensors):
+    """
+    Runs a single forward pass over a list of preprocessed (N, 3, H, W) image tensors and
+    returns the detections for each input, see postprocess().
+    """
+    tensors = [tensor.to(DEVICE, non_blocking=True) for tensor in tensors]
+    # Tiles stay uint8 until here, so large scenes never hold a float copy of every tile at once
+    batch = torch.cat([tensor.float().div_(255) if tensor.dtype == torch.uint8 else tensor for tensor in tensors])
+    if CHANNELS_LAST:
+        batch = batch.contiguous(memory_format=torch.channels_last) # NHWC input to match the converted weights
+    preds = backend(batch) # The backend casts to FP16 itself when the model runs in half precision
+    if isinstance(preds, (list, tuple)):
+        preds = preds[0] # PyTorch models also return the raw per-level feature maps
+    return postprocess(preds)
+
+if DEVICE == 'cuda':
+    # Inputs always have the same fixed size, so let cuDNN benchmark its convolution algorithms once and reuse the fastest
+    torch.backends.cudnn.benchmark = True
 
 # Load the YOLO model globally when the application starts
 model = None
+backend = None
 MODEL_LOADED = False
+CHANNELS_LAST = False
 try:
-    model = YOLO(MODEL_PATH)
+    model_path = resolve_model_path()
+    model = YOLO(model_path, task='detect')
+    # One call through the Ultralytics predictor sets up the inference backend (device placement, FP16,
+    # Conv+BN fusion); requests then call that backend directly and do their own NMS in postprocess()
+    GPU_POOL.submit(model, torch.zeros((1, 3, INPUT_SIZE, INPUT_SIZE)), imgsz=INPUT_SIZE, half=HALF,
+                    device=DEVICE, save=False, verbose=False).result()
+    backend = model.predictor.model
     MODEL_LOADED = True
-    print(f"🚀 YOLO model loaded successfully from: {MODEL_PATH}")
+    print(f"🚀 YOLO model loaded successfully from: {model_path}")
+    # Warm up with a dummy forward pass so CUDA context creation and kernel selection
+    # are paid at startup instead of by the first user request
+    GPU_POOL.submit(predict_batch, [torch.zeros((1, 3, INPUT_SIZE, INPUT_SIZE))]).result()
 except Exception as e:
     print(f"❌ Error loading YOLO model from {MODEL_PATH}: {e}")
     print("Please ensure the model file exists and is accessible.")
     MODEL_LOADED = False
 
-def allowed_file(filename):
+if MODEL_LOADED and DEVICE == 'cuda' and model_path == MODEL_PATH:
+    # Optimizations are best effort: if any of them fails (no Triton, unsupported GPU or driver, a graph
+    # break under CUDA graphs), the eager model that was just warmed up keeps serving
+    eager_model = backend.model
+    try:
+        # The predictor has now folded Conv+BN and converted the PyTorch module to FP16; switching its
+        # weights to channels_last lets cuDNN use NHWC tensor-core kernels (TensorRT picks its own layout)
+        backend.model.fuse() # No-op if already fused; kept explicit since compilation below assumes it
+        backend.to(memory_format=torch.channels_last)
+        CHANNELS_LAST = True
+        if TORCH_COMPILE and hasattr(torch, 'compile'):
+            backend.model = torch.compile(backend.model, mode='reduce-overhead', fullgraph=False)
+        # Compilation and CUDA graph capture happen per batch size, so trigger them all before serving
+        for batch_size in range(1, MAX_BATCH + 1):
+            GPU_POOL.submit(predict_batch, [torch.zeros((1, 3, INPUT_SIZE, INPUT_SIZE))] * batch_size).result()
+    except Exception as e:
+        print(f"⚠️ Could not optimize the PyTorch model ({e}); serving it uncompiled.")
+        backend.model = eager_model
+if MODEL_LOADED:
+    print("🔥 YOLO model warmed up.")
+
+def preprocess(image):
     """
-    Checks if the uploaded file has an allowed extension.
+    Letterboxes a BGR image into a (1, 3, 640, 640) float tensor on the CPU and returns it with the
+    (scale_x, scale_y, pad_x, pad_y) transform that maps network coordinates back onto the image.
+    """
+    height, width = image.shape[:2]
+    ratio = INPUT_SIZE / max(height, width)
+    new_h, new_w = round(height * ratio), round(width * ratio)
+    resized = cv2.resize(image, (new_w, new_h), interpolation=cv2.INTER_LINEAR)
+    # Centre the image on the grey (114) border Ultralytics trains with, matching letterbox_gpu()
+    left, top = (INPUT_SIZE - new_w) // 2, (INPUT_SIZE - new_h) // 2
+    padded = cv2.copyMakeBorder(resized, top, INPUT_SIZE - new_h - top, left, INPUT_SIZE - new_w - left,
+                                cv2.BORDER_CONSTANT, value=(114, 114, 114))
+    # blobFromImage swaps BGR->RGB, scales to [0, 1] and transposes HWC->CHW in a single C++ pass
+    blob = cv2.dnn.blobFromImage(padded, 1 / 255.0, swapRB=True, crop=False)
+    return torch.from_numpy(blob), (width / new_w, height / new_h, left, top)
+
+def letterbox_gpu(rgb):
+    """
+    Resizes a (3, H, W) uint8 RGB tensor on the GPU to fit the network input with its aspect ratio
+    kept, pads it to a square and returns the (1, 3, 640, 640) tensor with its transform.
+    """
+    height, width = rgb.shape[1:]
+    ratio = INPUT_SIZE / max(height, width)
+    new_h, new_w = round(height * ratio), round(width * ratio)
+    tensor = F.interpolate(rgb.unsqueeze(0).float().div_(255), size=(new_h, new_w), mode='bilinear', align_corners=False)
+    # Centre the image on the grey (114) border Ultralytics trains with
+    left, top = (INPUT_SIZE - new_w) // 2, (INPUT_SIZE - new_h) // 2
+    tensor = F.pad(tensor, (left, INPUT_SIZE - new_w - left, top, INPUT_SIZE - new_h - top), value=114 / 255)
+    return tensor, (width / new_w, height / new_h, left, top)
+
+def tile_starts(length):
+    """
+    Returns the tile origins along one side, covering it with INPUT_SIZE tiles overlapping by at least TILE_OVERLAP.
     """
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+    if length <= INPUT_SIZE:
+        return [0]
+    return list(range(0, length - INPUT_SIZE, INPUT_SIZE - TILE_OVERLAP)) + [length - INPUT_SIZE]
 
-def encode_image_to_base64(image_path):
+def tile_image(rgb):
     """
-    Converts an image file to a base64 string for embedding in HTML.
+    Cuts a (3, H, W) uint8 RGB tensor into overlapping full-resolution tiles and returns the
+    (N, 3, 640, 640) uint8 batch with one transform per tile.
     """
-    try:
-        with open(image_path, "rb") as img_file:
-            return base64.b64encode(img_file.read()).decode('utf-8')
-    except IOError as e:
-        print(f"Error encoding image {image_path} to base64: {e}")
+    height, width = rgb.shape[1:]
+    tiles, transforms = [], []
+    for y in tile_starts(height):
+        for x in tile_starts(width):
+            tile = rgb[:, y:y + INPUT_SIZE, x:x + INPUT_SIZE]
+            # Tiles of a side shorter than the input are padded at the right/bottom, which doesn't shift boxes
+            tiles.append(F.pad(tile, (0, INPUT_SIZE - tile.shape[2], 0, INPUT_SIZE - tile.shape[1]), value=114))
+            transforms.append((1, 1, -x, -y)) # Shifts tile coordinates by the tile's offset
+    return torch.stack(tiles), transforms
+
+def prepare_gpu_input(rgb):
+    """
+    Tiles a (3, H, W) uint8 RGB tensor on the GPU if it is large, otherwise letterboxes it.
+    Returns the network inputs with one transform per input.
+    """
+    if max(rgb.shape[1:]) > TILE_THRESHOLD:
+        return tile_image(rgb)
+    tensor, transform = letterbox_gpu(rgb)
+    return tensor, [transform]
+
+def upload_image_gpu(image):
+    """
+    Copies a CPU-decoded BGR image to the GPU as uint8 and prepares the network input there.
+    """
+    # Pinned staging lets the raw uint8 pixels (a quarter the size of a float blob) copy asynchronously
+    bgr = torch.from_numpy(image).pin_memory().to('cuda', non_blocking=True)
+    return prepare_gpu_input(bgr.permute(2, 0, 1).flip(0))
+
+def jpeg_orientation(raw):
+    """
+    Returns the EXIF Orientation tag of JPEG bytes, or 1 (upright) if there is none.
+    """
+    pos = 2 # Skip the SOI marker
+    while pos + 4 <= len(raw) and raw[pos] == 0xFF:
+        marker = raw[pos + 1]
+        size = int.from_bytes(raw[pos + 2:pos + 4], 'big')
+        if marker == 0xE1 and raw[pos + 4:pos + 10] == b'Exif\x00\x00':
+            tiff = raw[pos + 10:pos + 2 + size]
+            order = 'little' if tiff[:2] == b'II' else 'big'
+            ifd = int.from_bytes(tiff[4:8], order)
+            for i in range(int.from_bytes(tiff[ifd:ifd + 2], order)):
+                entry = tiff[ifd + 2 + 12 * i:ifd + 14 + 12 * i]
+                if int.from_bytes(entry[:2], order) == 0x0112:
+                    return int.from_bytes(entry[8:10], order)
+            return 1
+        if marker == 0xDA: # Start of scan: no metadata segments follow
+            break
+        pos += 2 + size
+    return 1
+
+def decode_jpeg_gpu(raw):
+    """
+    Decodes JPEG bytes with nvJPEG and returns the network input tensor, the image's
+    (height, width) and the transforms, mirroring load_image().
+    """
+    rgb = decode_jpeg(torch.frombuffer(bytearray(raw), dtype=torch.uint8), mode=ImageReadMode.RGB, device='cuda')
+    # The decoded (3, H, W) tensor is already RGB and CHW, so only tiling or resizing and padding remain;
+    # the pixels never come back to the host, since boxes are drawn by the browser
+    tensor, transforms = prepare_gpu_input(rgb)
+    return tensor, tuple(rgb.shape[1:]), transforms
+
+def load_image(raw, filename):
+    """
+    Decodes uploaded image bytes (on the GPU for JPEGs when CUDA is available) and returns
+    (network input tensor, (height, width), transforms), or None if the image cannot be decoded.
+    The tensor holds one input per transform: the whole image, or the tiles of a large scene.
+    """
+    # nvJPEG ignores EXIF orientation while OpenCV and browsers apply it, so rotated JPEGs take the
+    # CPU decoder and their boxes stay in the frame of the image they are drawn on
+    if DEVICE == 'cuda' and filename.lower().endswith(('.jpg', '.jpeg')) and jpeg_orientation(raw) == 1:
+        try:
+            return decode_jpeg_gpu(raw)
+        except RuntimeError:
+            pass # JPEG variants nvJPEG can't handle (e.g. CMYK) fall back to the CPU decoder
+    image = cv2.imdecode(np.frombuffer(raw, np.uint8), cv2.IMREAD_COLOR)
+    if image is None:
         return None
+    if DEVICE == 'cuda':
+        tensor, transforms = upload_image_gpu(image)
+    elif max(image.shape[:2]) > TILE_THRESHOLD:
+        tensor, transforms = tile_image(torch.from_numpy(image).permute(2, 0, 1).flip(0))
+    else:
+        tensor, transform = preprocess(image)
+        transforms = [transform]
+    return tensor, image.shape[:2], transforms
+
+def restore_result(results, shape, transforms):
+    """
+    Maps the detections of each network input back onto the original image of the given
+    (height, width) and merges them into a single (N, 6) tensor.
+    """
+    height, width = shape
+    restored, cut = [], []
+    for result, (scale_x, scale_y, pad_x, pad_y) in zip(results, transforms):
+        boxes = result.clone()
+        # Boxes that spill into the letterbox border are clipped back onto the image
+        boxes[:, [0, 2]] = ((boxes[:, [0, 2]] - pad_x) * scale_x).clamp(0, width)
+        boxes[:, [1, 3]] = ((boxes[:, [1, 3]] - pad_y) * scale_y).clamp(0, height)
+        restored.append(boxes)
+        if len(transforms) > 1:
+            # Tile transforms are (1, 1, -x, -y): flag boxes touching an edge that lies inside the scene
+            left, top = -pad_x, -pad_y
+            touches = torch.zeros(len(boxes), dtype=torch.bool)
+            if left > 0:
+                touches |= boxes[:, 0] <= left + TILE_EDGE_MARGIN
+            if top > 0:
+                touches |= boxes[:, 1] <= top + TILE_EDGE_MARGIN
+            if left + INPUT_SIZE < width:
+                touches |= boxes[:, 2] >= left + INPUT_SIZE - TILE_EDGE_MARGIN
+            if top + INPUT_SIZE < height:
+                touches |= boxes[:, 3] >= top + INPUT_SIZE - TILE_EDGE_MARGIN
+            cut.append(touches)
+    if len(restored) == 1:
+        return restored[0]
+    return merge_tile_detections(torch.cat(restored), torch.cat(cut))
+
+def merge_tile_detections(boxes, cut):
+    """
+    Merges the detections of overlapping tiles into one (N, 6) tensor. cut flags boxes touching
+    a tile edge inside the scene, i.e. possibly fragments of an aircraft that tile only partly sees.
+    """
+    # Whole boxes rank above fragments, then by confidence; NMS drops the plain duplicates from tile overlaps
+    rank = boxes[:, 4] + (~cut).float()
+    order = batched_nms(boxes[:, :4], rank, boxes[:, 5].long(), IOU_THRESHOLD)
+    boxes, cut = boxes[order], cut[order]
+    fragments = cut.nonzero().squeeze(1)
+    if not len(fragments):
+        return boxes[:MAX_DETECTIONS]
+    # A fragment lies mostly inside the box of the same aircraft from the next tile, yet their IoU is low,
+    # so pairs involving a fragment are compared by intersection over the smaller box instead.
+    # Only fragment rows are needed, so the matrix is (fragments, boxes) rather than (boxes, boxes)
+    pieces = boxes[fragments]
+    top_left = torch.max(pieces[:, None, :2], boxes[None, :, :2])
+    bottom_right = torch.min(pieces[:, None, 2:4], boxes[None, :, 2:4])
+    intersection = (bottom_right - top_left).clamp(min=0).prod(2)
+    area = (boxes[:, 2:4] - boxes[:, :2]).prod(1)
+    ios = intersection / torch.min(area[fragments, None], area[None, :]).clamp(min=1e-6)
+    same = (ios > TILE_MERGE_IOS) & (pieces[:, None, 5] == boxes[None, :, 5])
+    keep = torch.ones(len(boxes), dtype=torch.bool)
+    # Whole boxes all rank above fragments, so a fragment of an aircraft some tile sees whole is simply dropped
+    alive = ~same[:, ~cut].any(1)
+    same = same[:, fragments]
+    for i in range(len(fragments)):
+        if not alive[i]:
+            continue
+        duplicates = same[i] & alive
+        duplicates[:i + 1] = False
+        if duplicates.any():
+            # Only fragments remain for this aircraft (it is larger than the overlap): span them all
+            target, spanned = fragments[i], fragments[duplicates]
+            boxes[target, :2] = torch.min(boxes[target, :2], boxes[spanned, :2].min(0).values)
+            boxes[target, 2:4] = torch.max(boxes[target, 2:4], boxes[spanned, 2:4].max(0).values)
+            alive &= ~duplicates
+    keep[fragments] = alive
+    return boxes[keep][:MAX_DETECTIONS]
+
+BOX_COLOR = (0, 215, 255) # BGR colour for detection boxes and labels
+RESULT_JPEG_QUALITY = 85 # JPEG results are lossy previews, so q=85 keeps files small
+JPEG_ENCODE_PARAMS = [cv2.IMWRITE_JPEG_QUALITY, RESULT_JPEG_QUALITY, cv2.IMWRITE_JPEG_OPTIMIZE, 1]
+RESULT_ENCODE_PARAMS = JPEG_ENCODE_PARAMS if RESULT_FORMAT in ('jpg', 'jpeg') else []
+
+def draw_detections(image, result):
+    """
+    Draws detection boxes and confidence labels onto the image in place with OpenCV.
+    """
+    for x1, y1, x2, y2, conf, cls in result.tolist():
+        x1, y1, x2, y2, cls = int(x1), int(y1), int(x2), int(y2), int(cls)
+        cv2.rectangle(image, (x1, y1), (x2, y2), BOX_COLOR, 2)
+        cv2.putText(image, f'{model.names[cls]} {conf:.2f}', (x1, max(y1 - 4, 10)),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.5, BOX_COLOR, 1, cv2.LINE_AA)
+    return image
 
-@app.route('/')
-def index():
+# Disk writes run on their own small pool so they overlap with decoding and inference
+IO_POOL = ThreadPoolExecutor(max_workers=4, thread_name_prefix='sar-io')
+
+def write_file(path, data):
+    """Writes bytes to a file."""
+    with open(path, 'wb') as f:
+        f.write(data)
+
+pending_files = {} # File path -> future of the background job writing it, until the job finishes
+
+def track_pending_file(path, future):
     """
-    Renders the main homepage of the SAR aircraft detection system.
+    Registers a background write so the routes serving the file can wait for it, and reports failures.
     """
-    # HTML template content for the frontend
-    html_content = '''<!DOCTYPE html>
-<html lang="en">
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>AeroVision: SAR Aircraft Detection</title>
-    <link href="https://fonts.googleapis.com/css2?family=Poppins:wght@300;400;500;600;700&family=Inter:wght@300;400;500;600;700&display=swap" rel="stylesheet">
-    <style>
-        /* Base styles */
-        * {
-            margin: 0;
-            padding: 0;
-            box-sizing: border-box;
-        }
-
-        body {
-            font-family: 'Inter', sans-serif; /* Modern UI font */
-            background: linear-gradient(135deg, #0D0D0D 0%, #1A1A1A 50%, #262626 100%); /* Dark charcoal gradient */
-            color: #FFD700; /* Gold for main text */
-            min-height: 100vh;
-            overflow-x: hidden;
-            display: flex;
-            flex-direction: column;
-            align-items: center;
-            justify-content: flex-start; /* Align content to top */
-            padding-top: 40px; /* Space from top */
-        }
-
-        .container {
-            width: 95%;
-            max-width: 1400px;
-            margin: 0 auto;
-            padding: 30px;
-            background: rgba(26, 26, 26, 0.8); /* Slightly transparent dark */
-            border-radius: 20px;
-            box-shadow: 0 0 40px rgba(255, 215, 0, 0.2); /* Golden glow */
-            border: 1px solid rgba(255, 215, 0, 0.3); /* Subtle golden border */
-            backdrop-filter: blur(15px); /* Stronger blur effect */
-            animation: fadeIn 1s ease-out;
-        }
-
-        @keyframes fadeIn {
-            from { opacity: 0; transform: translateY(-20px); }
-            to { opacity: 1; transform: translateY(0); }
-        }
-
-        /* Header */
-        .header {
-            text-align: center;
-            margin-bottom: 50px;
-            position: relative;
-            padding-bottom: 20px;
-        }
-
-        .header::after { /* Underline effect */
-            content: '';
-            position: absolute;
-            bottom: 0;
-            left: 50%;
-            transform: translateX(-50%);
-            width: 150px;
-            height: 3px;
-            background: linear-gradient(90deg, transparent, #FFD700, transparent); /* Golden underline */
-            border-radius: 5px;
-        }
-
-        h1 {
-            font-family: 'Poppins', sans-serif; /* Futuristic font for title */
-            font-size: 3em;
-            margin-bottom: 10px;
-            color: #FFD700; /* Bright Gold */
-            text-shadow: 0 0 30px rgba(255, 215, 0, 0.6); /* Stronger glow */
-            letter-spacing: 3px;
-            animation: textGlow 2s infinite alternate;
-        }
-
-        @keyframes textGlow {
-            from { text-shadow: 0 0 10px rgba(255, 215, 0, 0.4), 0 0 20px rgba(255, 215, 0, 0.2); }
-            to { text-shadow: 0 0 20px rgba(255, 215, 0, 0.6), 0 0 40px rgba(255, 215, 0, 0.4); }
-        }
-
-        .subtitle {
-            font-size: 1.3em;
-            color: #AAAAAA; /* Lighter gray for contrast on dark */
-            margin-bottom: 20px;
-        }
-
-        /* Upload Section */
-        .upload-section {
-            background: rgba(35, 35, 35, 0.6);
-            border: 2px dashed #FFD700; /* Neon dashed golden border */
-            border-radius: 18px;
-            padding: 50px;
-            text-align: center;
-            margin-bottom: 50px;
-            transition: all 0.4s ease-in-out;
-            backdrop-filter: blur(12px);
-            box-shadow: 0 0 25px rgba(255, 215, 0, 0.15);
-            position: relative; /* For pulsing ring */
-        }
-
-        .upload-section:hover {
-            border-color: #FFEA00;
-            background: rgba(255, 215, 0, 0.08);
-            transform: translateY(-5px) scale(1.01);
-            box-shadow: 0 0 35px rgba(255, 215, 0, 0.3);
-        }
-
-        .upload-section.dragover {
-            border-color: #FFFF00;
-            background: rgba(255, 215, 0, 0.15);
-            transform: scale(1.03);
-        }
-
-        .upload-icon {
-            font-size: 5em;
-            color: #FFD700; /* Gold */
-            margin-bottom: 25px;
-            animation: pulse 2s infinite alternate;
-        }
-
-        @keyframes pulse {
-            from { transform: scale(1); opacity: 0.8; }
-            to { transform: scale(1.05); opacity: 1; }
-        }
-
-        .upload-section h3 {
-            font-family: 'Poppins', sans-serif;
-            font-size: 1.8em;
-            color: #FFD700; /* Gold */
-            margin-bottom: 15px;
-        }
-
-        .upload-section p {
-            font-size: 1.1em;
-            color: #CCCCCC; /* Lighter gray */
-            margin: 20px 0;
-        }
-
-        .file-input-wrapper {
-            position: relative;
-            overflow: hidden;
-            display: inline-block;
-            margin-top: 20px;
-        }
-
-        .file-input {
-            position: absolute;
-            left: -9999px;
-        }
-
-        .file-input-button {
-            background: linear-gradient(45deg, #FFD700, #FFA500); /* Gold to Orange-Gold gradient */
-            color: black; /* Black text on gold button */
-            padding: 18px 35px;
-            border: none;
-            border-radius: 50px;
-            cursor: pointer;
-            font-size: 1.2em;
-            font-weight: 700;
-            transition: all 0.3s ease;
-            box-shadow: 0 5px 20px rgba(255, 215, 0, 0.4);
-            text-transform: uppercase;
-            letter-spacing: 1px;
-            font-family: 'Poppins', sans-serif;
-            position: relative;
-            z-index: 1;
-        }
-
-        .file-input-button:hover {
-            transform: translateY(-3px);
-            box-shadow: 0 8px 25px rgba(255, 215, 0, 0.6);
-            background: linear-gradient(45deg, #FFE000, #FFC000); /* Brighter gold on hover */
-        }
-
-        /* Pulsing ring animation for button */
-        .file-input-button.pulsing::before {
-            content: '';
-            position: absolute;
-            top: -5px;
-            left: -5px;
-            right: -5px;
-            bottom: -5px;
-            border: 2px solid rgba(255, 215, 0, 0.5); /* Golden pulse ring */
-            border-radius: 50px;
-            animation: pulseRing 1.5s infinite ease-out;
-            z-index: 0;
-        }
-
-        @keyframes pulseRing {
-            0% { transform: scale(0.8); opacity: 0.7; }
-            50% { transform: scale(1.1); opacity: 0.3; }
-            100% { transform: scale(0.8); opacity: 0.7; }
-        }
-
-        /* Progress Bar */
-        .progress-bar {
-            width: 80%;
-            height: 6px;
-            background: #333333; /* Darker background for progress bar */
-            border-radius: 3px;
-            overflow: hidden;
-            margin: 30px auto 0;
-            display: none;
-            box-shadow: inset 0 0 5px rgba(255, 215, 0, 0.2); /* Golden shadow */
-        }
-
-        .progress-fill {
-            height: 100%;
-            background: linear-gradient(90deg, rgba(255, 215, 0, 0.2) 0%, #FFD700 50%, rgba(255, 215, 0, 0.2) 100%); /* Golden gradient fill */
-            background-size: 200% 100%;
-            animation: progressShimmer 1.5s infinite linear;
-            border-radius: 3px;
-        }
-
-        @keyframes progressShimmer {
-            0% { background-position: -200% 0; }
-            100% { background-position: 200% 0; }
-        }
-
-        /* Error Message */
-        .error-message {
-            background: rgba(239, 68, 68, 0.15);
-            color: #fca5a5;
-            padding: 18px;
-            border-radius: 12px;
-            border: 1px solid rgba(239, 68, 68, 0.4);
-            margin-top: 30px;
-            display: none;
-            font-size: 1.1em;
-            text-align: center;
-            box-shadow: 0 0 15px rgba(239, 68, 68, 0.2);
-        }
-
-        /* Results Section */
-        .results-section {
-            display: none;
-            grid-template-columns: repeat(auto-fit, minmax(300px, 1fr)); /* Adjusted for smaller images */
-            gap: 40px;
-            margin-top: 50px;
-            padding: 30px;
-            background: rgba(25, 35, 45, 0.6); /* Dark transparent */
-            border-radius: 18px;
-            box-shadow: 0 0 30px rgba(255, 215, 0, 0.1); /* Golden shadow */
-            border: 1px solid rgba(255, 215, 0, 0.2); /* Golden border */
-        }
-
-        .image-container {
-            background: rgba(35, 45, 55, 0.8); /* Dark transparent */
-            border-radius: 15px;
-            padding: 25px;
-            backdrop-filter: blur(10px);
-            border: 1px solid rgba(100, 110, 120, 0.4); /* Slightly lighter dark border */
-            box-shadow: 0 0 20px rgba(255, 215, 0, 0.1); /* Golden shadow */
-            display: flex;
-            flex-direction: column;
-            align-items: center;
-        }
-
-        .image-container h3 {
-            color: #FFD700; /* Gold */
-            margin-bottom: 20px;
-            font-size: 1.6em;
-            font-family: 'Poppins', sans-serif;
-            text-align: center;
-        }
-
-        .image-container img {
-            width: 100%;
-            max-width: 400px; /* Further reduced image size */
-            height: auto;
-            border-radius: 12px;
-            border: 3px solid rgba(255, 215, 0, 0.5); /* Golden border */
-            box-shadow: 0 0 15px rgba(255, 215, 0, 0.3); /* Golden shadow */
-            transition: transform 0.3s ease;
-        }
-
-        .image-container img:hover {
-            transform: scale(1.02);
-        }
-
-        .download-button {
-            background: linear-gradient(45deg, #FFD700, #FFA500); /* Gold to Orange-Gold gradient */
-            color: black; /* Black text on button */
-            padding: 12px 25px;
-            border: none;
-            border-radius: 30px;
-            cursor: pointer;
-            font-size: 1em;
-            font-weight: 600;
-            margin-top: 20px;
-            transition: all 0.3s ease;
-            box-shadow: 0 3px 10px rgba(255, 215, 0, 0.3); /* Golden shadow */
-            font-family: 'Inter', sans-serif;
-        }
-
-        .download-button:hover {
-            transform: translateY(-2px);
-            box-shadow: 0 5px 15px rgba(255, 215, 0, 0.5);
-        }
-
-        /* Stats Panel */
-        .stats-panel {
-            display: none; /* Hidden by default */
-            background: rgba(25, 35, 45, 0.8); /* Dark transparent */
-            border-radius: 20px;
-            padding: 35px;
-            margin-top: 50px;
-            backdrop-filter: blur(15px);
-            border: 1px solid rgba(255, 215, 0, 0.3); /* Golden border */
-            box-shadow: 0 0 40px rgba(255, 215, 0, 0.2); /* Golden shadow */
-            animation: slideUp 0.8s ease-out;
-        }
-
-        @keyframes slideUp {
-            from { opacity: 0; transform: translateY(50px); }
-            to { opacity: 1; transform: translateY(0); }
-        }
-
-        .stats-panel h3 {
-            color: #FFD700; /* Gold */
-            margin-bottom: 30px;
-            font-size: 1.8em;
-            text-align: center;
-            font-family: 'Poppins', sans-serif;
-            text-shadow: 0 0 20px rgba(255, 215, 0, 0.4); /* Golden shadow */
-        }
-
-        .stats-grid {
-            display: grid;
-            grid-template-columns: repeat(auto-fit, minmax(220px, 1fr));
-            gap: 25px;
-        }
-
-        .stat-item {
-            text-align: center;
-            padding: 20px;
-            background: rgba(255, 215, 0, 0.1); /* Transparent gold background */
-            border-radius: 15px;
-            border: 1px solid rgba(255, 215, 0, 0.3); /* Golden border */
-            box-shadow: 0 0 15px rgba(255, 215, 0, 0.1); /* Golden shadow */
-            transition: transform 0.3s ease, box-shadow 0.3s ease;
-        }
-
-        .stat-item:hover {
-            transform: translateY(-5px);
-            box-shadow: 0 0 25px rgba(255, 215, 0, 0.3);
-        }
-
-        .stat-number {
-            font-size: 2.8em;
-            font-weight: bold;
-            color: #FFD700; /* Brighter Gold */
-            text-shadow: 0 0 15px rgba(255, 215, 0, 0.7); /* Golden shadow */
-            font-family: 'Poppins', sans-serif;
-            margin-bottom: 5px;
-        }
-
-        .stat-label {
-            color: #AAAAAA; /* Lighter gray */
-            font-size: 1em;
-            margin-top: 8px;
-            text-transform: uppercase;
-            letter-spacing: 0.5px;
-            font-weight: 500;
-        }
-
-        /* Threat Level Specific Styles */
-        #threatLevel.HIGH { color: #ff6b6b; text-shadow: 0 0 10px #ff6b6b; } /* Red */
-        #threatLevel.MEDIUM { color: #ffd166; text-shadow: 0 0 10px #ffd166; } /* Orange */
-        #threatLevel.LOW { color: #06d6a0; text-shadow: 0 0 10px #06d6a0; } /* Green */
-
-        /* JSON Viewer */
-        /* Removed .json-viewer-container as per request */
-
-        /* Loading Overlay */
-        .loading-overlay {
-            position: fixed;
-            top: 0;
-            left: 0;
-            width: 100%;
-            height: 100%;
-            background: rgba(0, 0, 0, 0.95); /* Pure black transparent */
-            display: none;
-            flex-direction: column;
-            justify-content: center;
-            align-items: center;
-            z-index: 1000;
-            animation: overlayFadeIn 0.5s ease-out;
-        }
-
-        @keyframes overlayFadeIn {
-            from { opacity: 0; }
-            to { opacity: 1; }
-        }
-
-        .loading-spinner {
-            width: 80px;
-            height: 80px;
-            border: 5px solid #333333; /* Dark gray border */
-            border-top: 5px solid #FFD700; /* Golden spinner */
-            border-radius: 50%;
-            animation: spin 1.2s linear infinite, glow 1.5s infinite alternate;
-            margin-bottom: 20px;
-        }
-
-        @keyframes spin {
-            0% { transform: rotate(0deg); }
-            100% { transform: rotate(360deg); }
-        }
-
-        @keyframes glow {
-            from { box-shadow: 0 0 10px #FFD700; }
-            to { box-shadow: 0 0 25px #FFD700, 0 0 40px rgba(255, 215, 0, 0.5); }
-        }
-
-        .loading-overlay p {
-            color: #FFD700; /* Gold */
-            font-size: 1.5em;
-            font-family: 'Poppins', sans-serif;
-            text-shadow: 0 0 15px rgba(255, 215, 0, 0.5); /* Golden shadow */
-        }
-
-        /* Radar Background Animation */
-        .radar-bg {
-            position: fixed;
-            top: 0;
-            left: 0;
-            width: 100%;
-            height: 100%;
-            pointer-events: none;
-            z-index: -1; /* Above aircraft particles */
-            overflow: hidden;
-        }
-
-        .radar-sweep {
-            position: absolute;
-            top: 50%;
-            left: 50%;
-            width: 800px; /* Larger radar */
-            height: 800px;
-            border: 3px solid rgba(255, 215, 0, 0.1); /* Subtle golden border */
-            border-radius: 50%;
-            transform: translate(-50%, -50%);
-            animation: radar-pulse 6s ease-in-out infinite, rotate 20s linear infinite; /* Added rotation */
-            box-shadow: 0 0 50px rgba(255, 215, 0, 0.1); /* Golden shadow */
-        }
-
-        .radar-sweep::before { /* Inner sweep line */
-            content: '';
-            position: absolute;
-            top: 0;
-            left: 50%;
-            width: 2px;
-            height: 100%;
-            background: linear-gradient(to bottom, rgba(255, 215, 0, 0.8), transparent); /* Golden sweep */
-            transform-origin: bottom;
-            animation: sweep 6s linear infinite;
-        }
-
-        @keyframes radar-pulse {
-            0%, 100% { transform: translate(-50%, -50%) scale(0.9); opacity: 0.2; }
-            50% { transform: translate(-50%, -50%) scale(1.1); opacity: 0.05; }
-        }
-
-        @keyframes rotate {
-            from { transform: translate(-50%, -50%) rotate(0deg); }
-            to { transform: translate(-50%, -50%) rotate(360deg); }
-        }
-
-        /* Blurry Aircraft Particles Background */
-        .aircraft-particles-bg {
-            position: fixed;
-            top: 0;
-            left: 0;
-            width: 100%;
-            height: 100%;
-            pointer-events: none;
-            z-index: -2; /* Behind radar */
-            overflow: hidden;
-        }
-
-        .aircraft-particles-bg .particle {
-            position: absolute;
-            background-color: rgba(255, 215, 0, 0.1); /* Subtle golden hue */
-            border-radius: 50%; /* Circular blob */
-            filter: blur(25px); /* Heavy blur */
-            opacity: 0; /* Start hidden */
-            animation-iteration-count: infinite;
-            animation-timing-function: linear;
-            transform: translate(-50%, -50%); /* Center origin for transforms */
-        }
-
-        /* Individual particle sizes, positions, and animations */
-        .aircraft-particles-bg .particle-1 {
-            width: 100px;
-            height: 60px;
-            top: 10%;
-            left: 5%;
-            animation: floatParticle 20s infinite alternate, fadeInOut 10s infinite;
-            animation-delay: 0s;
-            background-color: rgba(255, 215, 0, 0.15);
-            border-radius: 40%; /* More elliptical */
-        }
-        .aircraft-particles-bg .particle-2 {
-            width: 80px;
-            height: 50px;
-            top: 80%;
-            left: 90%;
-            animation: floatParticle 25s infinite alternate reverse, fadeInOut 12s infinite;
-            animation-delay: 2s;
-            background-color: rgba(255, 215, 0, 0.1);
-            border-radius: 60%;
-        }
-        .aircraft-particles-bg .particle-3 {
-            width: 120px;
-            height: 70px;
-            top: 40%;
-            left: 70%;
-            animation: floatParticle 18s infinite alternate, fadeInOut 9s infinite;
-            animation-delay: 4s;
-            background-color: rgba(255, 215, 0, 0.2);
-            border-radius: 30%;
-        }
-        .aircraft-particles-bg .particle-4 {
-            width: 70px;
-            height: 40px;
-            top: 25%;
-            left: 30%;
-            animation: floatParticle 22s infinite alternate reverse, fadeInOut 11s infinite;
-            animation-delay: 6s;
-            background-color: rgba(255, 215, 0, 0.12);
-            border-radius: 55%;
-        }
-        .aircraft-particles-bg .particle-5 {
-            width: 90px;
-            height: 55px;
-            top: 65%;
-            left: 15%;
-            animation: floatParticle 28s infinite alternate, fadeInOut 13s infinite;
-            animation-delay: 8s;
-            background-color: rgba(255, 215, 0, 0.18);
-            border-radius: 45%;
-        }
-
-        @keyframes floatParticle {
-            0% { transform: translate(-50%, -50%) translateX(0) translateY(0) rotate(0deg); }
-            25% { transform: translate(-50%, -50%) translateX(10vw) translateY(5vh) rotate(10deg); }
-            50% { transform: translate(-50%, -50%) translateX(0) translateY(10vh) rotate(20deg); }
-            75% { transform: translate(-50%, -50%) translateX(-10vw) translateY(5vh) rotate(10deg); }
-            100% { transform: translate(-50%, -50%) translateX(0) translateY(0) rotate(0deg); }
-        }
-
-        @keyframes fadeInOut {
-            0%, 100% { opacity: 0; }
-            20%, 80% { opacity: 0.3; }
-        }
-
-        /* Responsive adjustments */
-        @media (max-width: 1024px) {
-            .container {
-                width: 98%;
-                padding: 15px;
-            }
-            h1 { font-size: 2.5em; }
-            .subtitle { font-size: 1.1em; }
-            .upload-section { padding: 40px; }
-            .upload-icon { font-size: 4em; }
-            .file-input-button { padding: 15px 30px; font-size: 1.1em; }
-            .results-section { grid-template-columns: 1fr; gap: 30px; }
-            .stats-grid { grid-template-columns: repeat(auto-fit, minmax(180px, 1fr)); }
-            .stat-number { font-size: 2.2em; }
-            .loading-spinner { width: 60px; height: 60px; }
-            .loading-overlay p { font-size: 1.2em; }
-            .radar-sweep { width: 600px; height: 600px; }
-        }
-
-        @media (max-width: 768px) {
-            h1 { font-size: 2em; letter-spacing: 2px; }
-            .subtitle { font-size: 1em; }
-            .upload-section { padding: 30px; }
-            .upload-icon { font-size: 3.5em; }
-            .file-input-button { padding: 12px 25px; font-size: 1em; }
-            .stats-grid { grid-template-columns: 1fr; }
-            .stat-number { font-size: 2.2em; }
-            .image-container img { max-width: 100%; }
-            .radar-sweep { width: 400px; height: 400px; }
-        }
-
-        @media (max-width: 480px) {
-            .container { padding: 10px; }
-            h1 { font-size: 1.8em; letter-spacing: 1px; }
-            .subtitle { font-size: 0.9em; }
-            .upload-section { padding: 20px; }
-            .upload-icon { font-size: 3em; }
-            .file-input-button { padding: 10px 20px; font-size: 0.9em; }
-            .stats-panel h3 { font-size: 1.5em; }
-            .stat-item { padding: 15px; }
-            .stat-number { font-size: 1.8em; }
-            .loading-spinner { width: 40px; height: 40px; }
-            .loading-overlay p { font-size: 1em; }
-            .radar-sweep { width: 300px; height: 300px; }
-        }
-    </style>
-</head>
-<body>
-    <!-- Blurry Aircraft Background Animation -->
-    <div class="aircraft-particles-bg">
-        <div class="particle particle-1"></div>
-        <div class="particle particle-2"></div>
-        <div class="particle particle-3"></div>
-        <div class="particle particle-4"></div>
-        <div class="particle particle-5"></div>
-    </div>
-
-    <!-- Background Radar Animation -->
-    <div class="radar-bg">
-        <div class="radar-sweep"></div>
-    </div>
-
-    <div class="container">
-        <!-- Header Section -->
-        <div class="header">
-            <h1>AeroVision</h1>
-            <p class="subtitle">Advanced SAR Aircraft Detection & Analysis</p>
-        </div>
-
-        <!-- Image Upload Section -->
-        <div class="upload-section" id="uploadSection">
-            <div class="upload-icon">✈️</div>
-            <h3>Upload SAR Image for Detection</h3>
-            <p>Drag and drop your SAR image file here, or click the button below to select.</p>
-            <div class="file-input-wrapper">
-                <input type="file" id="fileInput" class="file-input" accept=".png,.jpg,.jpeg,.bmp,.tiff,.tif">
-                <button class="file-input-button" id="uploadButton">Select SAR Image</button>
-            </div>
-            <div class="progress-bar" id="progressBar">
-                <div class="progress-fill" id="progressFill"></div>
-            </div>
-        </div>
-
-        <!-- Error Message Display -->
-        <div class="error-message" id="errorMessage"></div>
-
-        <!-- Results Display Section -->
-        <div class="results-section" id="resultsSection">
-            <div class="image-container">
-                <h3>Original Image</h3>
-                <img id="originalImage" src="" alt="Original SAR Image" onerror="this.onerror=null; this.src='https://placehold.co/400x400/333/FFF?text=Image+Load+Error'; console.error('Error loading original image');">
-                <button class="download-button" id="downloadOriginal">Download Original</button>
-            </div>
-            <div class="image-container">
-                <h3>Detected Output</h3>
-                <img id="resultImage" src="" alt="Detection Results" onerror="this.onerror=null; this.src='https://placehold.co/400x400/333/FFF?text=Image+Load+Error'; console.error('Error loading result image');">
-                <button class="download-button" id="downloadResult">Download Result</button>
-            </div>
-        </div>
-
-        <!-- Statistics Panel -->
-        <div class="stats-panel" id="statsPanel">
-            <h3>Analysis Summary</h3>
-            <div class="stats-grid">
-                <div class="stat-item">
-                    <div class="stat-number" id="detectionCount">0</div>
-                    <div class="stat-label">Aircraft Detected</div>
-                </div>
-                <div class="stat-item">
-                    <div class="stat-number" id="confidence">0%</div>
-                    <div class="stat-label">Average Confidence</div>
-                </div>
-                <div class="stat-item">
-                    <div class="stat-number" id="processingTime">0s</div>
-                    <div class="stat-label">Inference Time</div>
-                </div>
-                <div class="stat-item">
-                    <div class="stat-number" id="threatLevel">LOW</div>
-                    <div class="stat-label">Threat Level</div>
-                </div>
-            </div>
-        </div>
-    </div>
-
-    <!-- Loading Overlay -->
-    <div class="loading-overlay" id="loadingOverlay">
-        <div>
-            <div class="loading-spinner"></div>
-            <p>Processing Image...</p>
-            <p style="font-size:0.9em; margin-top: 10px; color: #AAAAAA;">Analyzing SAR data for aircraft signatures.</p>
-        </div>
-    </div>
-
-    <script>
-        // Get DOM elements
-        const uploadSection = document.getElementById('uploadSection');
-        const fileInput = document.getElementById('fileInput');
-        const progressBar = document.getElementById('progressBar');
-        const progressFill = document.getElementById('progressFill');
-        const errorMessage = document.getElementById('errorMessage');
-        const resultsSection = document.getElementById('resultsSection');
-        const statsPanel = document.getElementById('statsPanel');
-        const loadingOverlay = document.getElementById('loadingOverlay');
-        const originalImage = document.getElementById('originalImage');
-        const resultImage = document.getElementById('resultImage');
-        const downloadOriginalButton = document.getElementById('downloadOriginal');
-        const downloadResultButton = document.getElementById('downloadResult');
-        const uploadButton = document.getElementById('uploadButton'); // Reference to the upload button
-        
-        // Removed JSON viewer related elements
-        // const jsonViewerContainer = document.getElementById('jsonViewerContainer');
-        // const toggleJsonViewerButton = document.getElementById('toggleJsonViewer');
-        // const jsonOutput = document.getElementById('jsonOutput');
-
-        let currentOriginalFileName = ''; // To store original filename for download
-        let currentResultFileName = '';   // To store result filename for download
-        let currentDetectionData = null;  // To store raw detection data for JSON viewer (still kept for potential future use or debugging)
-
-        // Event listener for the custom file input button
-        uploadButton.addEventListener('click', () => {
-            fileInput.click(); // Trigger the hidden file input click
-        });
-
-        // Drag and drop event listeners for the upload section
-        uploadSection.addEventListener('dragover', (e) => {
-            e.preventDefault(); // Prevent default drag behavior
-            uploadSection.classList.add('dragover'); // Add 'dragover' class for visual feedback
-        });
-
-        uploadSection.addEventListener('dragleave', (e) => {
-            e.preventDefault(); // Prevent default drag behavior
-            uploadSection.classList.remove('dragover'); // Remove 'dragover' class
-        });
-
-        uploadSection.addEventListener('drop', (e) => {
-            e.preventDefault(); // Prevent default drop behavior (e.g., opening file in browser)
-            uploadSection.classList.remove('dragover'); // Remove 'dragover' class
-            const files = e.dataTransfer.files; // Get dropped files
-            if (files.length > 0) {
-                handleFile(files[0]); // Process the first dropped file
-            }
-        });
+    pending_files[path] = future
 
-        // Event listener for when a file is selected via the input
-        fileInput.addEventListener('change', (e) => {
-            if (e.target.files.length > 0) {
-                handleFile(e.target.files[0]); // Process the selected file
-            }
-        });
-
-        // Function to handle the file processing (upload and inference)
-        function handleFile(file) {
-            console.log('handleFile: File selected', file.name, file.type);
-            // Validate file type
-            const allowedTypes = ['image/png', 'image/jpeg', 'image/bmp', 'image/tiff'];
-            if (!allowedTypes.includes(file.type)) {
-                showError('Invalid file type. Please select a SAR image (PNG, JPG, JPEG, BMP, TIFF, TIF).');
-                return;
-            }
+    def forget(done):
+        pending_files.pop(path, None)
+        if done.exception() is not None:
+            print(f"❌ Failed to write {path}: {done.exception()}")
 
-            // Prepare form data for upload
-            const formData = new FormData();
-            formData.append('file', file);
-
-            // Reset UI elements and show loading state
-            errorMessage.style.display = 'none';
-            resultsSection.style.display = 'none';
-            statsPanel.style.display = 'none';
-            // Removed JSON viewer related display resets
-            // jsonViewerContainer.style.display = 'none'; 
-            // jsonOutput.style.display = 'none'; 
-            // toggleJsonViewerButton.textContent = 'Show Raw JSON'; 
-
-            loadingOverlay.style.display = 'flex';
-            progressBar.style.display = 'block';
-            progressFill.style.width = '0%'; // Reset progress bar
-            uploadButton.classList.add('pulsing'); // Add pulsing animation to button
-
-            // Simulate progress for better UX during upload (actual progress is hard to track with fetch)
-            let progress = 0;
-            const progressInterval = setInterval(() => {
-                if (progress < 90) { // Cap simulated progress before server response
-                    progress += Math.random() * 5; // Simulate varying progress speed
-                    if (progress > 90) progress = 90;
-                    progressFill.style.width = progress + '%';
-                }
-            }, 150); // Update every 150ms
-
-            const startTime = Date.now(); // Record start time for processing time calculation
-
-            // Send the file to the backend
-            fetch('/upload', {
-                method: 'POST',
-                body: formData
-            })
-            .then(response => {
-                console.log('handleFile: Fetch response received', response.status);
-                // Check if the response is OK (status 200-299)
-                if (!response.ok) {
-                    // If not OK, parse error message from server or throw generic error
-                    return response.json().then(errorData => {
-                        throw new Error(errorData.error || `Server responded with status ${response.status}`);
-                    });
-                }
-                return response.json(); // Parse JSON response
-            })
-            .then(data => {
-                console.log('handleFile: JSON data received', data);
-                clearInterval(progressInterval); // Stop simulated progress
-                progressFill.style.width = '100%'; // Set to 100% on success
-                uploadButton.classList.remove('pulsing'); // Remove pulsing animation
-
-                // Small delay to show 100% progress before hiding loading overlay
-                setTimeout(() => {
-                    loadingOverlay.style.display = 'none';
-                    progressBar.style.display = 'none';
-                }, 500); // Half-second delay
-
-                if (data.success) {
-                    currentDetectionData = data.detections; // Store raw data
-                    showResults(data, Date.now() - startTime); // Display results
-                } else {
-                    showError(data.error || 'An unknown error occurred during processing.');
-                }
-            })
-            .catch(error => {
-                console.error('handleFile: Fetch error caught', error);
-                clearInterval(progressInterval); // Stop simulated progress on error
-                uploadButton.classList.remove('pulsing'); // Remove pulsing animation
-                loadingOverlay.style.display = 'none';
-                progressBar.style.display = 'none';
-                showError('Network error or processing failed: ' + error.message);
-            });
-        }
-
-        // Function to display detection results and statistics
-        function showResults(data, processingTime) {
-            console.log('showResults: Displaying results with data', data);
-            // Set image sources using base64 data
-            originalImage.src = 'data:image/jpeg;base64,' + data.original_image;
-            resultImage.src = 'data:image/jpeg;base64,' + data.result_image;
-            
-            // Store filenames for download buttons
-            currentOriginalFileName = `original_${data.filename}`;
-            currentResultFileName = `detected_${data.filename}`; // More descriptive name
-
-            // Show result sections
-            resultsSection.style.display = 'grid';
-            statsPanel.style.display = 'block';
-            // Removed JSON viewer related display show
-            // jsonViewerContainer.style.display = 'block'; 
-
-            // Update statistics in the control panel
-            document.getElementById('detectionCount').textContent = data.detection_count;
-            
-            // Calculate and display average confidence
-            const avgConfidence = data.detections.length > 0 
-                ? data.detections.reduce((sum, det) => sum + det.confidence, 0) / data.detections.length
-                : 0;
-            document.getElementById('confidence').textContent = `${Math.round(avgConfidence * 100)}%`;
-            
-            // Display processing time
-            document.getElementById('processingTime').textContent = `${(processingTime / 1000).toFixed(2)}s`;
-            
-            // Determine and display threat level based on detection count
-            const threatLevelElement = document.getElementById('threatLevel');
-            let threatLevel = 'LOW';
-            if (data.detection_count >= 5) {
-                threatLevel = 'HIGH';
-            } else if (data.detection_count >= 2) {
-                threatLevel = 'MEDIUM';
-            }
-            threatLevelElement.textContent = threatLevel;
-            // Add/remove classes for threat level styling
-            threatLevelElement.classList.remove('LOW', 'MEDIUM', 'HIGH');
-            threatLevelElement.classList.add(threatLevel);
-            
-            // Scroll to results for better UX
-            resultsSection.scrollIntoView({ behavior: 'smooth', block: 'start' });
-        }
-
-        // Function to display error messages
-        function showError(message) {
-            console.error('showError:', message);
-            errorMessage.textContent = `ERROR: ${message}`;
-            errorMessage.style.display = 'block';
-            // Ensure other sections are hidden on error
-            progressBar.style.display = 'none';
-            loadingOverlay.style.display = 'none';
-            resultsSection.style.display = 'none';
-            statsPanel.style.display = 'none';
-            // Removed JSON viewer related display hide
-            // jsonViewerContainer.style.display = 'none';
-            uploadButton.classList.remove('pulsing'); // Remove pulsing animation
-        }
-
-        // --- Download Functionality ---
-        function downloadImage(imgElement, filename) {
-            console.log('downloadImage: Attempting to download', filename);
-            const link = document.createElement('a');
-            link.href = imgElement.src; // Use the base64 data URL
-            link.download = filename; // Set the desired filename for download
-            document.body.appendChild(link); // Append to body (required for Firefox)
-            link.click(); // Programmatically click the link to trigger download
-            document.body.removeChild(link); // Clean up the link element
-        }
-
-        downloadOriginalButton.addEventListener('click', () => {
-            if (originalImage.src && originalImage.src !== window.location.href) { // Ensure image is loaded
-                downloadImage(originalImage, currentOriginalFileName);
-            } else {
-                showError('No original image available for download.');
-            }
-        });
+    future.add_done_callback(forget)
 
-        downloadResultButton.addEventListener('click', () => {
-            if (resultImage.src && resultImage.src !== window.location.href) { // Ensure image is loaded
-                downloadImage(resultImage, currentResultFileName);
-            } else {
-                showError('No result image available for download.');
-            }
-        });
-
-        // --- JSON Viewer Toggle Functionality ---
-        // Removed JSON Viewer Toggle Functionality as per request
-        /*
-        toggleJsonViewerButton.addEventListener('click', () => {
-            if (jsonOutput.style.display === 'none') {
-                if (currentDetectionData && currentDetectionData.length > 0) { // Check if data exists AND is not empty
-                    jsonOutput.textContent = JSON.stringify(currentDetectionData, null, 2); // Pretty print JSON
-                    jsonOutput.style.display = 'block';
-                    toggleJsonViewerButton.textContent = 'Hide Raw JSON';
-                } else {
-                    // Explicit message if no detections or data is null/empty
-                    jsonOutput.textContent = 'No raw detection data available for this image or no aircraft were detected.';
-                    jsonOutput.style.display = 'block';
-                    toggleJsonViewerButton.textContent = 'Hide Raw JSON';
-                }
-            } else {
-                jsonOutput.style.display = 'none';
-                toggleJsonViewerButton.textContent = 'Show Raw JSON';
-            }
-        });
-        */
-    </script>
-</body>
-</html>'''
-    
-    # Write the HTML content to index.html in the templates directory
-    # This ensures the template is always up-to-date when the Flask app runs
-    try:
-        with open(os.path.join(basedir, 'templates', 'index.html'), 'w', encoding='utf-8') as f:
-            f.write(html_content)
-        print("✅ index.html template created/updated successfully.")
-    except IOError as e:
-        print(f"❌ Error writing index.html: {e}")
+async def wait_for_pending_file(path):
+    """
+    Waits until a background write of the given file (if any) has finished.
+    """
+    pending = pending_files.get(path)
+    if pending is not None:
+        await asyncio.wait([pending])
+
+recent_results = deque() # Result paths in the order they were created, oldest first
+result_sources = {} # Result path -> (upload path, detections) for result images not rendered yet
+
+def remember_result(result_path):
+    """
+    Tracks a newly created result and deletes the oldest ones beyond MAX_RESULTS.
+    """
+    recent_results.append(result_path)
+    # A result still being rendered would be written after its deletion and linger; it is evicted on a later call
+    while len(recent_results) > MAX_RESULTS and recent_results[0] not in pending_files:
+        evicted = recent_results.popleft()
+        result_sources.pop(evicted, None)
+        try:
+            os.unlink(evicted)
+        except FileNotFoundError:
+            pass # Never rendered
+
+result_cache = OrderedDict() # Upload content hash -> detections, least recently used first
+
+def content_hash(raw):
+    """Returns a short blake2b digest identifying the uploaded bytes."""
+    return hashlib.blake2b(raw, digest_size=16).hexdigest()
+
+def lookup_cached_result(digest):
+    """
+    Returns the cached (N, 6) detections for an upload hash, or None if it isn't cached.
+    """
+    detections = result_cache.get(digest)
+    if detections is not None:
+        result_cache.move_to_end(digest)
+    return detections
+
+def cache_result(digest, detections):
+    """Caches detections under their upload hash, evicting the least recently used beyond RESULT_CACHE_SIZE."""
+    result_cache[digest] = detections
+    result_cache.move_to_end(digest)
+    while len(result_cache) > RESULT_CACHE_SIZE:
+        result_cache.popitem(last=False)
+
+def save_result_image(result_path, image, result):
+    """
+    Annotates the image with its detections, encodes it in RESULT_FORMAT in memory and writes it to disk.
+    Returns the encoded bytes so inline responses don't have to read the file back.
+    """
+    _, encoded = cv2.imencode(f'.{RESULT_FORMAT}', draw_detections(image, result), RESULT_ENCODE_PARAMS)
+    encoded = encoded.tobytes()
+    write_file(result_path, encoded)
+    return encoded
+
+def render_result_image(result_path, upload_path, detections):
+    """
+    Renders a result image from the stored upload, see save_result_image().
+    """
+    image = cv2.imread(upload_path, cv2.IMREAD_COLOR)
+    if image is None:
+        raise FileNotFoundError(f'Upload {upload_path} is no longer available')
+    return save_result_image(result_path, image, detections)
+
+def save_inline_result_image(result_path, image, result):
+    """
+    Saves the result image like save_result_image(), but returns it as JPEG whatever RESULT_FORMAT is,
+    so ?inline=1 clients always receive the same format they did before results became BMP.
+    """
+    encoded = save_result_image(result_path, image, result)
+    if RESULT_FORMAT in ('jpg', 'jpeg'):
+        return encoded
+    # draw_detections annotated the image in place, so it only needs encoding again
+    _, encoded = cv2.imencode('.jpg', image, JPEG_ENCODE_PARAMS)
+    return encoded.tobytes()
+
+async def ensure_result_image(result_path):
+    """
+    Renders a result image the first time it is requested and waits until it is on disk.
+    """
+    source = result_sources.pop(result_path, None)
+    if source is not None:
+        upload_path, detections = source
+
+        async def render():
+            await wait_for_pending_file(upload_path)
+            return await asyncio.get_running_loop().run_in_executor(None, render_result_image, result_path, upload_path, detections)
+
+        # Registered before awaiting anything, so concurrent requests wait on the same render
+        track_pending_file(result_path, asyncio.ensure_future(render()))
+    await wait_for_pending_file(result_path)
+
+inference_queue = None # Created at startup so it belongs to the serving event loop
+batch_worker_task = None
+carried_item = None # A queued request that didn't fit in the previous batch
+
+async def next_batch():
+    """
+    Waits for a queued request, then collects more until MAX_BATCH inputs are reached or BATCH_WINDOW elapses.
+    """
+    global carried_item
+    loop = asyncio.get_running_loop()
+    if carried_item is not None:
+        items, carried_item = [carried_item], None
+    else:
+        items = [await inference_queue.get()]
+    inputs = len(items[0][0])
+    deadline = loop.time() + BATCH_WINDOW
+    while inputs < MAX_BATCH:
+        if not inference_queue.empty():
+            item = inference_queue.get_nowait() # Take whatever is already queued without waiting
+        else:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                item = await asyncio.wait_for(inference_queue.get(), timeout)
+            except asyncio.TimeoutError:
+                break
+        # Requests carrying several tiles may not fit; exported engines only accept up to MAX_BATCH inputs
+        if inputs + len(item[0]) > MAX_BATCH:
+            carried_item = item # Starts the next batch instead
+            break
+        items.append(item)
+        inputs += len(item[0])
+    return items
+
+async def batch_worker():
+    """
+    Drains the inference queue in batches and resolves each request's future with its result.
+    """
+    loop = asyncio.get_running_loop()
+    while True:
+        items = await next_batch()
+        try:
+            results = await loop.run_in_executor(GPU_POOL, predict_batch, [tensor for tensor, _ in items])
+        except Exception as e:
+            for _, future in items:
+                if not future.done():
+                    future.set_exception(e)
+            continue
+
+        start = 0
+        for tensor, future in items:
+            if not future.done(): # The client may have disconnected while waiting
+                future.set_result(results[start:start + len(tensor)])
+            start += len(tensor)
+
+async def run_inference(tensor):
+    """
+    Queues a preprocessed (N, 3, H, W) tensor of at most MAX_BATCH inputs for the batch worker
+    and waits for the detections of each input.
+    """
+    future = asyncio.get_running_loop().create_future()
+    await inference_queue.put((tensor, future))
+    return await future
+
+@app.before_serving
+async def configure_executor():
+    """Sizes the thread pool that blocking image and model work is offloaded to."""
+    asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=THREADS, thread_name_prefix='sar'))
+
+@app.before_serving
+async def start_batch_worker():
+    """Creates the inference queue and starts the batch worker on the serving loop."""
+    global inference_queue, batch_worker_task
+    inference_queue = asyncio.Queue()
+    batch_worker_task = asyncio.create_task(batch_worker())
+
+@app.after_serving
+async def stop_batch_worker():
+    """Stops the batch worker when the server shuts down."""
+    batch_worker_task.cancel()
+
+upload_cleanup_task = None
+
+def delete_old_uploads():
+    """
+    Deletes uploaded images last modified more than UPLOAD_MAX_AGE seconds ago.
+    """
+    cutoff = time.time() - UPLOAD_MAX_AGE
+    with os.scandir(UPLOAD_FOLDER) as entries:
+        for entry in entries:
+            try:
+                if entry.is_file() and entry.stat().st_mtime < cutoff:
+                    os.unlink(entry.path)
+            except FileNotFoundError:
+                pass # Removed by someone else in the meantime
+
+async def cleanup_uploads():
+    """
+    Sweeps old uploads out of UPLOAD_FOLDER every UPLOAD_CLEANUP_INTERVAL seconds.
+    """
+    loop = asyncio.get_running_loop()
+    while True:
+        await asyncio.sleep(UPLOAD_CLEANUP_INTERVAL)
+        try:
+            await loop.run_in_executor(IO_POOL, delete_old_uploads)
+        except OSError as e:
+            print(f"❌ Failed to clean up {UPLOAD_FOLDER}: {e}")
+
+@app.before_serving
+async def start_upload_cleanup():
+    """Starts the periodic upload cleanup on the serving loop, where it is enabled."""
+    global upload_cleanup_task
+    if SWEEP_UPLOADS:
+        upload_cleanup_task = asyncio.create_task(cleanup_uploads())
+
+@app.after_serving
+async def stop_upload_cleanup():
+    """Stops the upload cleanup when the server shuts down."""
+    if upload_cleanup_task is not None:
+        upload_cleanup_task.cancel()
 
-    return render_template('index.html')
+def allowed_file(filename):
+    """
+    Checks if the uploaded file has an allowed extension.
+    """
+    return filename.lower().endswith(_ALLOWED_SUFFIXES)
+
+def has_image_signature(file):
+    """
+    Checks the upload's magic number so mislabelled files are rejected before they are saved or decoded.
+    """
+    header = file.stream.read(16)
+    file.stream.seek(0)
+    return header.startswith(IMAGE_SIGNATURES)
+
+# The frontend page is static, so its bytes, compressed variants and ETags are computed once at import
+with open(os.path.join(basedir, 'templates', 'index.html'), 'rb') as f:
+    _INDEX_BYTES = f.read()
+_INDEX_ETAG = f'"{hashlib.md5(_INDEX_BYTES).hexdigest()}"'
+_INDEX_VARIANTS = {'gzip': gzip.compress(_INDEX_BYTES, compresslevel=9)}
+if brotli is not None:
+    _INDEX_VARIANTS['br'] = brotli.compress(_INDEX_BYTES, quality=11)
+
+@app.route('/')
+async def index():
+    """
+    Renders the main homepage of the SAR aircraft detection system.
+    """
+    # Serve the best precompressed variant the client accepts, so no compression happens per request
+    encoding = request.accept_encodings.best_match([enc for enc in ('br', 'gzip') if enc in _INDEX_VARIANTS])
+    etag = f'"{_INDEX_ETAG[1:-1]}-{encoding}"' if encoding else _INDEX_ETAG
+    headers = {'ETag': etag, 'Vary': 'Accept-Encoding', 'Cache-Control': 'public, max-age=300'}
+
+    # Browsers revalidating a cached copy get an empty 304 instead of the full page
+    if request.headers.get('If-None-Match') == etag:
+        return '', 304, headers
+    if encoding:
+        headers['Content-Encoding'] = encoding
+        return Response(_INDEX_VARIANTS[encoding], mimetype='text/html', headers=headers)
+    return Response(_INDEX_BYTES, mimetype='text/html', headers=headers)
+
+@app.errorhandler(413)
+async def upload_too_large(error):
+    """
+    Answers uploads over MAX_UPLOAD_MB with the JSON error shape the frontend expects instead of an HTML page.
+    """
+    return jsonify({'success': False, 'error': f'File is too large. Please upload an image under {MAX_UPLOAD_MB} MB.'}), 413
 
 @app.route('/upload', methods=['POST'])
-def upload_file():
+async def upload_file():
     """
     Handles file uploads, performs aircraft detection, and returns results.
     """
     if not MODEL_LOADED:
         return jsonify({'success': False, 'error': 'AI model not loaded. System is offline.'}), 500
     
-    if 'file' not in request.files:
+    files = await request.files
+    if 'file' not in files:
         return jsonify({'success': False, 'error': 'No file part in the request. Please select an image.'}), 400
     
-    file = request.files['file']
+    file = files['file']
     if file.filename == '':
         return jsonify({'success': False, 'error': 'No selected file. Please choose an image to upload.'}), 400
     
     if file and allowed_file(file.filename):
+        if not has_image_signature(file):
+            return jsonify({'success': False, 'error': 'File content does not match a supported image format.'}), 400
+
+        raw = file.read()
+        loop = asyncio.get_running_loop()
+        inline = request.args.get('inline') == '1'
+
+        # Identical bytes were already processed: their detections are reused and only decoding and inference are skipped;
+        # file names and URLs are still this upload's own, so nothing of the earlier uploader's is exposed
+        digest = await loop.run_in_executor(None, content_hash, raw)
+        cached = lookup_cached_result(digest)
+
         # Securely save the uploaded file with a timestamp to prevent overwrites
         filename = secure_filename(file.filename)
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S_%f') # Add microseconds for higher uniqueness
         filename_with_timestamp = f"{timestamp}_{filename}" 
         filepath = os.path.join(UPLOAD_FOLDER, filename_with_timestamp)
 
-        try:
-            file.save(filepath)
-            print(f"✅ File saved: {filepath}")
-        except Exception as e:
-            return jsonify({'success': False, 'error': f'Failed to save uploaded file: {str(e)}'}), 500
+        # Persist the upload in the background; decoding and inference work from the bytes already in memory
+        track_pending_file(filepath, loop.run_in_executor(IO_POOL, write_file, filepath, raw))
         
         try:
-            # Run YOLO inference on the uploaded image
-            # conf: confidence threshold, iou: Intersection Over Union threshold for NMS
-            results = model(filepath, conf=0.25, iou=0.7, save=False) # Adjusted conf for potentially better detection
-            
-            # Get the image with bounding boxes drawn by YOLO
-            # results[0].plot() returns a NumPy array (OpenCV BGR format)
-            result_img_np = results[0].plot() 
+            if cached is not None:
+                results = [cached]
+            else:
+                loaded = await loop.run_in_executor(None, load_image, raw, filename)
+                if loaded is None:
+                    return jsonify({'success': False, 'error': 'Could not decode the uploaded image. Please try another file.'}), 400
+                tensor, shape, transforms = loaded
+
+                # Run YOLO inference on the uploaded image (or its tiles, MAX_BATCH at a time); the batch worker
+                # may group it with other requests
+                chunks = await asyncio.gather(*(run_inference(chunk) for chunk in tensor.split(MAX_BATCH)))
+                # Mapping back and merging tiles is CPU work on up to thousands of boxes, so it stays off the event loop
+                restored = await loop.run_in_executor(None, restore_result, [result for chunk in chunks for result in chunk], shape, transforms)
+                results = [restored]
+                cache_result(digest, results[0])
             
             # Define paths for saving the result image
             name, ext = os.path.splitext(filename_with_timestamp)
-            # Save results as JPEG for consistent web display and smaller size
-            result_filename = f"detected_{name}.jpg" # Changed to 'detected_' for clarity
+            # Save results in RESULT_FORMAT (BMP by default, which needs no compression pass)
+            result_filename = f"detected_{name}.{RESULT_FORMAT}" # Changed to 'detected_' for clarity
             result_path = os.path.join(RESULTS_FOLDER, result_filename)
             
-            # Save the processed image using OpenCV
-            cv2.imwrite(result_path, result_img_np)
-            print(f"✅ Result image saved: {result_path}")
+            # The browser draws the boxes itself, so the annotated image is only rendered when
+            # /results is actually requested (or right away below for inline responses)
+            result_sources[result_path] = (filepath, results[0])
+            remember_result(result_path)
             
-            # Extract detection information
-            detections = []
-            boxes = results[0].boxes
-            if boxes is not None:
-                for box in boxes:
-                    detection = {
-                        'confidence': float(box.conf[0]), # Confidence score
-                        'class_id': int(box.cls[0]),     # Detected class ID
-                        'bbox': box.xyxy[0].tolist()     # Bounding box coordinates [x1, y1, x2, y2]
-                    }
-                    detections.append(detection)
-            
-            # Encode both original and result images to base64 for direct display in HTML
-            original_b64 = encode_image_to_base64(filepath)
-            result_b64 = encode_image_to_base64(result_path)
-
-            if original_b64 is None or result_b64 is None:
-                return jsonify({'success': False, 'error': 'Failed to encode images to base64.'}), 500
+            # Extract detection information; rows are [x1, y1, x2, y2, conf, cls], already on the host
+            detections = [
+                {
+                    'confidence': conf,             # Confidence score
+                    'class_id': int(cls),           # Detected class ID
+                    'bbox': [x1, y1, x2, y2]        # Bounding box coordinates [x1, y1, x2, y2]
+                }
+                for x1, y1, x2, y2, conf, cls in results[0].tolist()
+            ]
             
-            # Return JSON response with detection data and base64 images
-            return jsonify({
+            # Images are returned as URLs served straight from disk; the browser fetches (and caches) them
+            response = {
                 'success': True,
-                'original_image': original_b64,
-                'result_image': result_b64,
+                'original_url': url_for('get_upload', filename=filename_with_timestamp),
+                'result_url': url_for('get_result', filename=result_filename),
                 'detections': detections,
                 'detection_count': len(detections),
                 'filename': filename_with_timestamp # Pass original filename for client-side download naming
-            })
+            }
+
+            # API clients that still expect embedded images can opt in with ?inline=1
+            if inline:
+                # Render from the bytes in memory rather than waiting for and re-reading the upload
+                del result_sources[result_path]
+                image = await loop.run_in_executor(None, cv2.imdecode, np.frombuffer(raw, np.uint8), cv2.IMREAD_COLOR)
+                result_saved = loop.run_in_executor(None, save_inline_result_image, result_path, image, results[0])
+                track_pending_file(result_path, result_saved)
+                response['original_image'] = base64.b64encode(raw).decode('ascii')
+                response['result_image'] = base64.b64encode(await result_saved).decode('ascii')
+
+            return jsonify(response)
             
         except Exception as e:
             # Log the full traceback for detailed server-side debugging
@@ -1109,20 +889,44 @@ def upload_file():
     
     return jsonify({'success': False, 'error': 'Invalid file type. Please upload a supported image format.'}), 400
 
-# Routes to serve uploaded and result images directly (though base64 is used for display)
+# Routes to serve uploaded and result images directly; the frontend displays images from these URLs
 @app.route('/results/<filename>')
-def get_result(filename):
-    """Serves result images from the RESULTS_FOLDER."""
-    return send_from_directory(RESULTS_FOLDER, filename)
+async def get_result(filename):
+    """Serves result images from the RESULTS_FOLDER, rendering them on first request."""
+    await ensure_result_image(os.path.join(RESULTS_FOLDER, filename))
+    # conditional=True answers If-Modified-Since/Range requests without resending the file
+    return await send_from_directory(RESULTS_FOLDER, filename, conditional=True)
 
 @app.route('/uploads/<filename>')
-def get_upload(filename):
+async def get_upload(filename):
     """Serves original uploaded images from the UPLOAD_FOLDER."""
-    return send_from_directory(UPLOAD_FOLDER, filename)
+    # The response to /upload doesn't wait for the file to reach disk, so a fetch may have to
+    await wait_for_pending_file(os.path.join(UPLOAD_FOLDER, filename))
+    return await send_from_directory(UPLOAD_FOLDER, filename, conditional=True)
+
+IMAGE_MAX_AGE = 86400 # Seconds browsers may reuse a served image without revalidating
+
+@app.after_request
+async def cache_image_responses(response):
+    """
+    Marks served images as cacheable: upload and result names carry a microsecond timestamp,
+    so the content behind a URL never changes and browsers needn't revalidate it.
+    """
+    if request.endpoint in ('get_result', 'get_upload') and response.status_code in (200, 206, 304):
+        response.headers['Cache-Control'] = f'public, max-age={IMAGE_MAX_AGE}, immutable'
+    return response
 
 if __name__ == '__main__':
     print("🚀 SAR Aircraft Detection System Starting...")
     print("📡 Access the application at: http://localhost:5000")
-    # Run the Flask application
-    # debug=True provides auto-reloading and a debugger, but should be False in production
-    app.run(debug=True, host='0.0.0.0', port=5000)
+    # Serve through Hypercorn with the production settings (equivalent to: hypercorn -c file:hypercorn_conf.py app:app).
+    # serve() runs in this process on the loop we start, so worker_class is applied here by hand; hypercorn's own
+    # runner isn't used because its worker imports app.py again, loading the model a second time (as would the reloader)
+    from hypercorn.asyncio import serve
+    from hypercorn.config import Config
+    config = Config.from_pyfile(os.path.join(basedir, 'hypercorn_conf.py'))
+    if config.worker_class == 'uvloop':
+        import uvloop
+        uvloop.run(serve(app, config))
+    else:
+        asyncio.run(serve(app, config))
@@ -0,0 +1,21 @@
+from ultralytics import YOLO
+import os
+import sys
+
+def main():
+    # 'engine' builds a TensorRT FP16 engine (NVIDIA GPU required); pass 'onnx' to export for ONNX Runtime instead
+    export_format = sys.argv[1] if len(sys.argv) > 1 else 'engine'
+    # The app groups concurrent uploads into batches of up to MAX_BATCH images, so the export must accept them
+    max_batch = int(os.environ.get('MAX_BATCH', 8))
+
+    # Resolved next to this script, where app.py looks for the weights, whatever the current directory is
+    basedir = os.path.abspath(os.path.dirname(__file__))
+    model = YOLO(os.path.join(basedir, 'runs', 'detect', 'sar_aircraft_detector', 'weights', 'best.pt'))
+    # FP16 only for the TensorRT engine: a half-precision ONNX export needs a GPU and the app runs ONNX on the CPU
+    options = {'half': True, 'workspace': 4} if export_format == 'engine' else {}
+    exported = model.export(format=export_format, imgsz=640, dynamic=True, batch=max_batch, **options)
+
+    print(f"✅ Export complete: {exported}. app.py will load it on the next start.")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,15 @@
+# Hypercorn settings for serving AeroVision in production:
+#   hypercorn -c file:hypercorn_conf.py app:app
+import importlib.util
+import os
+
+bind = [os.getenv('BIND', '0.0.0.0:5000')]
+
+# One worker process owns the CUDA context and the single copy of the YOLO model.
+# Concurrency comes from the event loop plus the app's thread pool (sized by THREADS)
+# for decoding, preprocessing and encoding, which release the GIL inside cv2/torch.
+workers = 1
+worker_class = 'uvloop' if importlib.util.find_spec('uvloop') else 'asyncio'
+
+# Give in-flight detections time to finish on shutdown
+graceful_timeout = 60
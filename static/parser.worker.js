@@ -0,0 +1,8 @@
+// Parses /upload JSON responses off the main thread so large detection lists don't stall the UI
+self.onmessage = (event) => {
+    try {
+        self.postMessage({ data: JSON.parse(event.data) });
+    } catch (error) {
+        self.postMessage({ error: error.message });
+    }
+};